@@ -1,7 +1,5 @@
 import asyncio
 import datetime
-import re
-import tempfile
 from argparse import ArgumentParser
 from collections.abc import Iterable
 from typing import assert_never
@@ -10,94 +8,166 @@ import chess
 import chess.engine
 import chess.pgn
 import chess.svg
-import click
-import pyperclip
 
 from . import nags
 from .base import Base
 from .repl import argparse_command
 from .utils import (
     MoveNumber,
-    add_to_comment_text,
+    append_comment_text,
     castling_descr,
     comment_text,
+    fast_fen,
+    join_comment,
     score_str,
-    update_comment_text,
+    split_comment,
 )
 
+# Column labels and row iteration orders for `show_board()`, from White's and Black's
+# point of view respectively.
+COLS_WHITE: str = "a b c d e f g h"
+COLS_BLACK: str = "h g f e d c b a"
+ROWS_WHITE: range = range(7, -1, -1)
+ROWS_BLACK: range = range(8)
+SQUARE_NAMES: list[str] = chess.SQUARE_NAMES
+# What to print at every empty square in `show_board()`.
+EMPTY_SQUARES: tuple[str, ...] = tuple(
+    "+" if (chess.square_rank(sq) + chess.square_file(sq)) % 2 == 0 else "-" for sq in chess.SQUARES
+)
+# The order in which pieces are listed below the board in `show_board()`.
+COLORS: tuple[chess.Color, ...] = (chess.WHITE, chess.BLACK)
+PIECE_ORDER: tuple[chess.PieceType, ...] = (
+    chess.KING,
+    chess.QUEEN,
+    chess.ROOK,
+    chess.BISHOP,
+    chess.KNIGHT,
+    chess.PAWN,
+)
+
+# Every arrow color accepted by `arrow add`, possibly abbreviated, mapped to its full name.
+ARROW_COLORS: dict[str, str] = {
+    "red": "red",
+    "r": "red",
+    "yellow": "yellow",
+    "y": "yellow",
+    "green": "green",
+    "g": "green",
+    "blue": "blue",
+    "b": "blue",
+}
+
+
+def board_key(board: chess.Board) -> tuple:
+    """A key which is equal for two boards iff `board_lines()` gives the same lines for them.
+
+    This must list everything `board_lines()` reads from the board, including what
+    `castling_descr()` reads: The castling rights are cleaned differently for Chess960.
+    """
+    return (
+        board.pawns,
+        board.knights,
+        board.bishops,
+        board.rooks,
+        board.queens,
+        board.kings,
+        board.occupied_co[chess.WHITE],
+        board.turn,
+        board.castling_rights,
+        board.ep_square,
+        board.chess960,
+    )
+
+
+def board_lines(board: chess.Board) -> Iterable[str]:
+    """Yield the lines of an ASCII drawing of a board with some extra information below it."""
+    cols, rows = (COLS_WHITE, ROWS_WHITE) if board.turn == chess.WHITE else (COLS_BLACK, ROWS_BLACK)
+    # What to print at every square, together with the list of pieces for each color which is
+    # printed below the board.
+    cells: list[str] = list(EMPTY_SQUARES)
+    piece_lists: list[str] = []
+    for color in COLORS:
+        parts: list[str] = ["White: " if color == chess.WHITE else "Black: "]
+        for piece_type in PIECE_ORDER:
+            mask: chess.Bitboard = board.pieces_mask(piece_type, color)
+            if mask:
+                symbol: str = chess.Piece(piece_type, color).symbol()
+                squares: list[chess.Square] = list(chess.scan_forward(mask))
+                for square in squares:
+                    cells[square] = symbol
+                parts += (symbol, ",".join(SQUARE_NAMES[sq] for sq in squares), " ")
+        piece_lists.append("".join(parts))
+
+    yield "  " + cols
+    for row in rows:
+        # Slice out the whole row at once and flip it if it should be seen from Black's side.
+        row_cells: list[str] = cells[8 * row : 8 * row + 8]
+        if board.turn == chess.BLACK:
+            row_cells.reverse()
+        yield f"{row + 1} {" ".join(row_cells)} {row + 1}"
+    yield "  " + cols
+    yield ""
+    if board.ep_square is not None:
+        yield f"En-passant is possible at {SQUARE_NAMES[board.ep_square]}"
+    yield castling_descr(board)
+    yield from piece_lists
+    yield ("White" if board.turn == chess.WHITE else "Black") + " to move."
+
 
 class CurrMoveCmds(Base):
     """Commands related to the current move."""
 
+    # The key of the last board drawn by `iter_board_lines()` together with its lines.
+    _board_lines_cache: tuple[tuple, list[str]] | None = None
+
     def show_evaluation(self) -> str | None:
-        eval = self.game_node.eval()
+        node = self.game_node
+        eval = node.eval()
         if eval is None:
             return None
         text: str = score_str(eval.relative)
-        if self.game_node.eval_depth() is not None:
-            text += f", Depth: {self.game_node.eval_depth()}"
+        depth: int | None = node.eval_depth()
+        if depth is not None:
+            text += f", Depth: {depth}"
         return text
 
-    def show_fen(self) -> str:
-        return self.game_node.board().fen()
+    def show_fen(self, board: chess.Board | None = None) -> str:
+        """Get the FEN of the current position.
+
+        :param board: The board at the current position, if the caller has already computed it.
+        """
+        if board is None:
+            board = self.game_node.board()
+        return fast_fen(board)
 
     def show_nags(self) -> Iterable[str]:
-        for nag in self.game_node.nags:
-            yield f"  {nags.ascii_glyph(nag)}  {nags.description(nag)}"
-
-    def show_board(self) -> str:
-        board = self.game_node.board()
-        cols: str = " ".join(
-            map(
-                chr,
-                range(ord("a"), ord("h") + 1)
-                if board.turn == chess.WHITE
-                else range(ord("h"), ord("a") - 1, -1),
-            )
-        )
-        text: str = "  " + cols + "\n"
-        for row in range(8) if board.turn == chess.BLACK else range(7, -1, -1):
-            text += f"{row + 1} "
-            for col in range(8) if board.turn == chess.WHITE else range(7, -1, -1):
-                try:
-                    square_content: str = str(board.piece_map()[8 * row + col])
-                except KeyError:
-                    square_content = "+" if (row + col) % 2 == 0 else "-"
-                text += f"{square_content} "
-            text += f"{row + 1}\n"
-        text += "  " + cols + "\n\n"
-        if board.ep_square is not None:
-            text += f"En-passant is possible at {chess.square_name(board.ep_square)}\n"
-        text += castling_descr(board) + "\n"
-        for color in [chess.WHITE, chess.BLACK]:
-            text += "White" if color == chess.WHITE else "Black"
-            text += ": "
-            for piece_type in [
-                chess.KING,
-                chess.QUEEN,
-                chess.ROOK,
-                chess.BISHOP,
-                chess.KNIGHT,
-                chess.PAWN,
-            ]:
-                piece = chess.Piece(piece_type, color)
-                squares = board.pieces(piece_type, color)
-                if squares:
-                    text += piece.symbol()
-                    text += ",".join(chess.SQUARE_NAMES[sq] for sq in squares)
-                    text += " "
-            text += "\n"
-        text += ("White" if board.turn == chess.WHITE else "Black") + " to move."
-        return text
+        for nag in sorted(self.game_node.nags):
+            yield f"{nags.ascii_glyph(nag)}  {nags.description(nag)}"
+
+    def iter_board_lines(self, board: chess.Board | None = None) -> Iterable[str]:
+        """Yield the lines of the ASCII board shown by `show_board()` one at a time.
+
+        The lines are reused if the position is the same as the last time.
+
+        :param board: The board at the current position, if the caller has already computed it.
+        """
+        if board is None:
+            board = self.game_node.board()
+        key: tuple = board_key(board)
+        if self._board_lines_cache is None or self._board_lines_cache[0] != key:
+            self._board_lines_cache = (key, list(board_lines(board)))
+        yield from self._board_lines_cache[1]
+
+    def show_board(self, board: chess.Board | None = None) -> str:
+        return "\n".join(self.iter_board_lines(board))
 
     def show_arrows(self) -> str | None:
-        arrows: list = self.game_node.arrows()
+        arrows: list[chess.svg.Arrow] = self.game_node.arrows()
         if not arrows:
             return None
-        return str([
-            f"{arrow.color} {chess.square_name(arrow.tail)}->{chess.square_name(arrow.head)}"
-            for arrow in self.game_node.arrows()
-        ])
+        return ", ".join(
+            f"{a.color} {SQUARE_NAMES[a.tail]}->{SQUARE_NAMES[a.head]}" for a in arrows
+        )
 
     def show_clock(self) -> str | None:
         clock = self.game_node.clock()
@@ -110,26 +180,31 @@ class CurrMoveCmds(Base):
     @argparse_command(show_argparser, alias=["sh"])
     def do_show(self, args) -> None:
         """Show position, comments, NAGs and more about the current move."""
-        self.poutput(f"FEN: {self.show_fen()}")
-        self.poutput(f"\n{self.show_board()}")
-        starting_comment: str = comment_text(self.game_node.starting_comment)
-        if isinstance(self.game_node, chess.pgn.ChildNode) and starting_comment:
-            self.poutput(starting_comment)
-            self.poutput(f"    {MoveNumber.last(self.game_node)} {self.game_node.san()}")
-        comment: str = comment_text(self.game_node.comment)
+        node = self.game_node
+        board = node.board()
+        lines: list[str] = [f"FEN: {self.show_fen(board)}", ""]
+        lines += self.iter_board_lines(board)
+        if (
+            node.starting_comment
+            and isinstance(node, chess.pgn.ChildNode)
+            and (starting_comment := comment_text(node.starting_comment))
+        ):
+            lines.append(starting_comment)
+            lines.append(f"    {MoveNumber.last(node)} {node.san()}")
+        comment: str = comment_text(node.comment)
         if comment:
-            self.poutput(comment)
-        for nag in self.show_nags():  # noqa: B007
-            self.poutput("NAG: {nag}")
+            lines.append(comment)
+        lines += (f"NAG: {nag}" for nag in self.show_nags())
         evaluation: str | None = self.show_evaluation()
         if evaluation is not None:
-            self.poutput("Evaluation: {evaluation}")
+            lines.append(f"Evaluation: {evaluation}")
         arrows: str | None = self.show_arrows()
         if arrows is not None:
-            self.poutput(f"Arrows: {arrows}")
+            lines.append(f"Arrows: {arrows}")
         clock: str | None = self.show_clock()
         if clock is not None:
-            self.poutput(f"Clock: {clock}")
+            lines.append(f"Clock: {clock}")
+        self.poutput("\n".join(lines))
 
     fen_argparser = ArgumentParser()
     fen_argparser.add_argument(
@@ -140,6 +215,8 @@ class CurrMoveCmds(Base):
     def do_fen(self, args) -> None:
         """Show the position as FEN (Forsynth-Edwards Notation)."""
         if args.clipboard:
+            import pyperclip
+
             pyperclip.copy(self.show_fen())
         else:
             self.poutput(self.show_fen())
@@ -186,22 +263,22 @@ class CurrMoveCmds(Base):
     @argparse_command(comment_argparser, alias=["c"])
     async def do_comment(self, args) -> None:
         """Show, edit or remove the comment at the current move."""
-        if args.starting_comment and not self.game_node.starts_variation():
+        node = self.game_node
+        if args.starting_comment and not node.starts_variation():
             self.poutput(
                 "Error: Starting comments can only exist on moves that starts a variation."
             )
             return
 
-        comment: str = (
-            self.game_node.comment if not args.starting_comment else self.game_node.starting_comment
-        )
-        comment = comment if args.raw else comment_text(comment)
+        raw_comment: str = node.comment if not args.starting_comment else node.starting_comment
+        text, commands = split_comment(raw_comment)
+        comment = raw_comment if args.raw else text
 
         def set_comment(new_comment: str) -> None:
             if args.starting_comment:
-                self.game_node.starting_comment = new_comment
+                node.starting_comment = new_comment
             else:
-                self.game_node.comment = new_comment
+                node.comment = new_comment
 
         match args.subcmd:
             case "show" | "sh" | None:
@@ -209,20 +286,19 @@ class CurrMoveCmds(Base):
             case "rm":
                 set_comment("")
             case "set" | "s":
-                new_comment = (
-                    args.comment if args.raw else update_comment_text(comment, args.comment)
-                )
+                new_comment = args.comment if args.raw else join_comment(commands, args.comment)
                 set_comment(new_comment)
             case "append":
-                set_comment(add_to_comment_text(comment, args.comment))
+                set_comment(append_comment_text(commands, text, args.comment))
             case "edit" | "e":
-                fd, file_name = tempfile.mkstemp(suffix=".txt", text=True)
+                import click
+
                 new_comment: str | bytes | None = await asyncio.to_thread(click.edit, comment)
-                if isinstance(comment, bytes):
-                    comment = comment.decode()
+                if isinstance(new_comment, bytes):
+                    new_comment = new_comment.decode()
                 if new_comment is not None:
                     if not args.raw:
-                        new_comment = update_comment_text(comment, new_comment)
+                        new_comment = join_comment(commands, new_comment)
                     set_comment(new_comment)
                     print(f"Successfully updated comment to:\n{new_comment}")
             case _:
@@ -249,17 +325,18 @@ class CurrMoveCmds(Base):
 
         '!?') at the current move.
         """
+        node = self.game_node
         match args.subcmd:
             case "show":
                 for nag_str in self.show_nags():
-                    self.poutput("  " + nag_str)
+                    self.poutput(f"  {nag_str}")
             case "add":
                 try:
                     nag: int = nags.parse_nag(args.nag)
                 except ValueError as e:
                     self.poutput(f"Error: invalid NAG {args.nag}: {e}")
                     return
-                self.game_node.nags.add(nag)
+                node.nags.add(nag)
                 self.poutput(f"Set NAG ({nags.ascii_glyph(nag)}): {nags.description(nag)}.")
             case "rm":
                 try:
@@ -267,12 +344,12 @@ class CurrMoveCmds(Base):
                 except ValueError as e:
                     self.poutput(f"Error: invalid NAG {args.nag}: {e}")
                     return
-                try:
-                    self.game_node.nags.remove(nag)
-                except KeyError:
+                if nag in node.nags:
+                    node.nags.discard(nag)
+                else:
                     self.poutput(f"Error: NAG '{nags.ascii_glyph(nag)}' was not set on this move.")
             case "clear":
-                self.game_node.nags = set()
+                node.nags = set()
             case _:
                 raise AssertionError("Unknown subcommand.")
 
@@ -316,6 +393,7 @@ class CurrMoveCmds(Base):
     @argparse_command(evaluation_argparser, alias=["eval"])
     def do_evaluation(self, args) -> None:
         """Show, edit or remove evaluations at the current move."""
+        node = self.game_node
         match args.subcmd:
             case "show" | None:
                 text = self.show_evaluation()
@@ -324,7 +402,7 @@ class CurrMoveCmds(Base):
                 else:
                     self.poutput("No evaluation at this move.")
             case "rm":
-                self.game_node.set_eval(None)
+                node.set_eval(None)
             case "set":
                 if args.mate is not None:
                     score: chess.engine.Score = chess.engine.Mate(args.mate)
@@ -332,9 +410,7 @@ class CurrMoveCmds(Base):
                     score = chess.engine.Mate(-args.mated)
                 else:
                     score = chess.engine.Cp(args.cp)
-                self.game_node.set_eval(
-                    chess.engine.PovScore(score, self.game_node.turn()), args.depth
-                )
+                node.set_eval(chess.engine.PovScore(score, node.turn()), args.depth)
             case _:
                 raise AssertionError("Unknown subcommand.")
 
@@ -362,7 +438,7 @@ class CurrMoveCmds(Base):
     )
     arrow_add_argparser.add_argument(
         "color",
-        choices=["red", "r", "yellow", "y", "green", "g", "blue", "b"],
+        choices=ARROW_COLORS.keys(),
         default="green",
         nargs="?",
         help="Color of the arrow. Red/yellow/green/blue can be abbreviated as r/y/g/b.",
@@ -371,27 +447,26 @@ class CurrMoveCmds(Base):
     @argparse_command(arrow_argparser, alias=["ar"])
     def do_arrow(self, args) -> None:
         """Show, edit or remove arrows at the current move."""
-        color_abbreviations: dict[str, str] = {"g": "green", "y": "yellow", "r": "red", "b": "blue"}
-
+        node = self.game_node
         match args.subcmd:
             case "show" | "s" | "sh" | None:
                 text = self.show_arrows()
                 if text is not None:
                     self.poutput(text)
             case "add" | "a":
-                color = color_abbreviations.get(args.color, args.color)
-                self.game_node.set_arrows([
-                    *self.game_node.arrows(),
-                    chess.svg.Arrow(args._from, args.to, color=color),
-                ])
+                color: str = ARROW_COLORS[args.color]
+                arrows = node.arrows()
+                arrows.append(chess.svg.Arrow(args._from, args.to, color=color))
+                node.set_arrows(arrows)
             case "rm":
-                self.game_node.set_arrows(
-                    arr
-                    for arr in self.game_node.arrows()
-                    if not (args._from == arr.tail or args.to == arr.head)
-                )
+                arrows = node.arrows()
+                kept_arrows = [
+                    arr for arr in arrows if not (args._from == arr.tail or args.to == arr.head)
+                ]
+                if len(kept_arrows) != len(arrows):
+                    node.set_arrows(kept_arrows)
             case "clear" | "c" | "cl":
-                self.game_node.set_arrows([])
+                node.set_arrows([])
             case x:
                 assert_never(x)
 
@@ -410,26 +485,29 @@ class CurrMoveCmds(Base):
     def do_pgn_clock(self, args) -> None:
         """Show, edit or remove clock information in [%clk ...] annotations
         in the PGN comment at the current move."""
+        node = self.game_node
         match args.subcmd:
             case "show":
                 text = self.show_clock()
                 if text is not None:
                     self.poutput(text)
             case "rm":
-                self.game_node.set_clock(None)
+                node.set_clock(None)
             case "set":
-                time_parsed = re.fullmatch(r"(\d+)(:(\d+))?(:(\d+))?([.,](\d+))?", args.time)
-                if time_parsed is None:
+                whole, separator, fraction = args.time.replace(",", ".").partition(".")
+                time_parts: list[str] = whole.split(":")
+                if (
+                    len(time_parts) > 3
+                    or not all(part.isdecimal() for part in time_parts)
+                    or (separator and not fraction.isdecimal())
+                ):
                     self.poutput(f"Error: Couldn't parse time '{args.time}'.")
                     return
-                time_groups = time_parsed.groups()
-                time: float = float(time_groups[0])
-                if time_groups[2]:
-                    time = time * 60 + float(time_groups[2])
-                    if time_groups[4]:
-                        time = time * 60 + float(time_groups[4])
-                if time_groups[6]:
-                    time += float("0." + time_groups[6])
-                self.game_node.set_clock(time)
+                time: float = 0
+                for part in time_parts:
+                    time = time * 60 + int(part)
+                if fraction:
+                    time += float("0." + fraction)
+                node.set_clock(time)
             case _:
                 raise AssertionError("Unhandled subcommand.")
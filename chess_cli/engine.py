@@ -1,23 +1,23 @@
 import asyncio
 import enum
 import logging
-import logging.handlers
-import queue
 import shutil
 from collections import deque
-from collections.abc import AsyncGenerator, Mapping, Sequence
-from contextlib import asynccontextmanager, suppress
-from dataclasses import dataclass
+from collections.abc import AsyncGenerator, Callable, Iterable, Mapping, Sequence
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from types import MappingProxyType
 from typing import assert_never, override
 
 import chess.engine
 from prompt_toolkit.patch_stdout import StdoutProxy
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, TypeAdapter, field_serializer
 
 from .base import Base, CommandFailure, InitArgs
 
 ENGINE_TIMEOUT: int = 10  # Timeout for engine related operations.
 ENGINE_LONG_TIMEOUT: int = 120  # Timeout when opening engine.
+ENGINE_LOG_SIZE: int = 4096  # Max number of saved log messages from engines.
 
 
 class EngineProtocol(enum.StrEnum):
@@ -27,52 +27,157 @@ class EngineProtocol(enum.StrEnum):
     XBOARD = enum.auto()
 
 
+# A value for an engine option.
+type OptionValue = str | int | bool | None
+
+
 class EngineConf(BaseModel):
     """Configuration for an engine."""
 
     path: str  # Path of engine executable.
     protocol: EngineProtocol
-    options: dict[str, str | int | bool | None] = dict()
+    options: dict[str, OptionValue] = Field(default_factory=dict)
     fullname: str | None = None  # Full name of the engine from id.name.
     # The directory where the engine is installed.
     # This will be removed if the engine is removed.
     install_dir: str | None = None
     # Loaded instance of this engine. This is not really part of the configuration but stored here
     # anyway and discarded when saving the configuration.
-    loaded_as: set[str] = set()
+    loaded_as: set[str] = Field(default_factory=set, exclude=True)
+
+    # The TOML writer doesn't know about enums, so the protocol is dumped as a plain string.
+    @field_serializer("protocol")
+    def _serialize_protocol(self, protocol: EngineProtocol) -> str:
+        return protocol.value
+
 
+class EngineLogHandler(logging.Handler):
+    """A logging handler which saves messages in a bounded buffer.
 
-@dataclass
+    When the buffer is full, the oldest messages are dropped.
+    """
+
+    buffer: deque[str]
+
+    def __init__(self, maxlen: int) -> None:
+        super().__init__()
+        self.buffer = deque(maxlen=maxlen)
+
+    @override
+    def emit(self, record: logging.LogRecord) -> None:
+        self.buffer.append(record.getMessage())
+
+
+# Validates the whole 'engine-configurations' section of the config in one pass.
+_ENGINE_CONFS_ADAPTER: TypeAdapter[dict[str, EngineConf]] = TypeAdapter(dict[str, EngineConf])
+
+
+@dataclass(slots=True)
 class LoadedEngine:
     loaded_name: str  # The name with which the engine is loaded.
     config_name: str  # The name of the engine in the configuration.
     engine: chess.engine.Protocol  # The actual engine instance.
+    # Maps the lowercased names of the engine's options to their actual names.
+    option_names: dict[str, str] = field(repr=False)
+
+
+def _check_option_type(
+    name: str, option: chess.engine.Option, value: OptionValue, type_: type
+) -> None:
+    if not isinstance(value, type_):
+        raise ValueError(
+            f"{name} is a {option.type} according to the engine but the given type is"
+            f" {type(value)} which doesn't match very well."
+        )
+
+
+def _validate_text_option(name: str, option: chess.engine.Option, value: OptionValue) -> None:
+    _check_option_type(name, option, value, str)
+
+
+def _validate_combo_option(name: str, option: chess.engine.Option, value: OptionValue) -> None:
+    _check_option_type(name, option, value, str)
+    if not option.var:
+        raise ValueError(
+            f"There are no valid alternatives for {option.name}, so you cannot set it to"
+            " any value. It's strange I know, but I'm probably not the engine's author so"
+            " I can't do much about it."
+        )
+    if value not in option.var:
+        raise ValueError(
+            f"{value} is not a valid alternative for the combobox {option.name}. The list"
+            f" of valid options is: {option.var!r}."
+        )
+
+
+def _validate_spin_option(name: str, option: chess.engine.Option, value: OptionValue) -> None:
+    _check_option_type(name, option, value, int)
+    assert isinstance(value, int)
+    if option.min is not None and value < option.min:
+        raise ValueError(
+            f"The minimum value for {option.name} is {option.min}, you specified {value}."
+        )
+    if option.max is not None and value > option.max:
+        raise ValueError(
+            f"The maximum value for {option.name} is {option.max}, you specified {value}."
+        )
+
+
+def _validate_check_option(name: str, option: chess.engine.Option, value: OptionValue) -> None:
+    _check_option_type(name, option, value, bool)
+
+
+def _validate_button_option(name: str, option: chess.engine.Option, value: OptionValue) -> None:
+    if value is not None:
+        raise ValueError(
+            f"{name} is a button according to the engine but the given value is a"
+            f" {type(value)} which doesn't really make any sence."
+        )
+
+
+# Functions to validate a value for an engine option, indexed by the type of the option.
+# They raise ValueError if the value is invalid.
+_OPTION_VALIDATORS: dict[str, Callable[[str, chess.engine.Option, OptionValue], None]] = {
+    "string": _validate_text_option,
+    "file": _validate_text_option,
+    "path": _validate_text_option,
+    "combo": _validate_combo_option,
+    "spin": _validate_spin_option,
+    "check": _validate_check_option,
+    "button": _validate_button_option,
+    "reset": _validate_button_option,
+    "save": _validate_button_option,
+}
 
 
 class Engine(Base):
     """An extention to chess-cli to support chess engines."""
 
     _engine_confs: dict[str, EngineConf]  # Configuration for all the engines.
+    # A read-only view of `_engine_confs` which is returned by `engine_confs`.
+    _engine_confs_view: MappingProxyType[str, EngineConf]
     # All the currently loaded engines.  Note that this is indexed by the name given to the
     # loaded instance which may not be the same as in `_engine_confs`.
     _loaded_engines: dict[str, LoadedEngine]
+    # A read-only view of `_loaded_engines` which is returned by `loaded_engines`.
+    _loaded_engines_view: MappingProxyType[str, LoadedEngine]
     # The currently selected engine. Should be a member of loaded_engines.
     _selected_engine: LoadedEngine | None
-    _engines_saved_log: deque[str]  # Log messages from all engines.
-    # A queue for incoming log messages from engines.
-    _engines_log_queue: queue.SimpleQueue[logging.LogRecord]
+    _engines_log: EngineLogHandler  # Saves log messages from all engines.
 
     def __init__(self, args: InitArgs) -> None:
         self._engine_confs = {}
+        self._engine_confs_view = MappingProxyType(self._engine_confs)
         # No engines are loaded or selected at startup.
         self._loaded_engines = {}
+        self._loaded_engines_view = MappingProxyType(self._loaded_engines)
         self._selected_engine = None
 
         super().__init__(args)
 
         ## Setup logging:
-        self._engines_saved_log = deque()
-        self._engines_log_queue = queue.SimpleQueue()
+        self._engines_log = EngineLogHandler(ENGINE_LOG_SIZE)
+        chess.engine.LOGGER.addHandler(self._engines_log)
         log_handler = logging.StreamHandler(StdoutProxy())
         log_handler.setLevel(logging.WARNING)
         log_handler.setFormatter(logging.Formatter("%(message)s"))
@@ -82,18 +187,19 @@ class Engine(Base):
     @override
     async def cmd_loop(self, *args, **kwargs) -> None:
         await super().cmd_loop(*args, **kwargs)
-        while self.selected_engine is not None:
-            await self.close_engine(self.selected_engine)
+        for _, error in await self.close_engines(list(self._loaded_engines.values())):
+            if error is not None:
+                self.perror(f"Error: {error}")
 
     @property
     def engine_confs(self) -> Mapping[str, EngineConf]:
         """Get all configured engines."""
-        return self._engine_confs.items().mapping
+        return self._engine_confs_view
 
     @property
     def loaded_engines(self) -> Mapping[str, LoadedEngine]:
         """Get all the currently loaded engines in a {name: engine} dictionary."""
-        return self._loaded_engines.items().mapping
+        return self._loaded_engines_view
 
     @property
     def selected_engine(self) -> LoadedEngine | None:
@@ -117,16 +223,35 @@ class Engine(Base):
 
     async def close_engine(self, engine: LoadedEngine) -> None:
         """Stop and quit an engine."""
-        self._loaded_engines.pop(engine.loaded_name)
-        self.engine_confs[engine.config_name].loaded_as.remove(engine.loaded_name)
-        if self.selected_engine is engine:
-            try:
-                self.select_engine(next(iter(self.loaded_engines)))
-            except StopIteration:
-                self._selected_engine = None
+        loaded_engines: dict[str, LoadedEngine] = self._loaded_engines
+        loaded_engines.pop(engine.loaded_name)
+        self._engine_confs[engine.config_name].loaded_as.remove(engine.loaded_name)
+        if self._selected_engine is engine:
+            self._selected_engine = next(iter(loaded_engines.values()), None)
         async with self.engine_timeout(engine.loaded_name, close=False, context="close_engine()"):
             await engine.engine.quit()
 
+    async def close_engines(
+        self, engines: Iterable[LoadedEngine]
+    ) -> list[tuple[LoadedEngine, CommandFailure | None]]:
+        """Stop and quit several engines concurrently.
+
+        All engines are closed even if some of them fail.
+
+        :return: Every engine together with the error from closing it, or None if it was closed
+        without any problems.
+        """
+        engines = list(engines)
+        results: list[BaseException | None] = await asyncio.gather(
+            *(self.close_engine(engine) for engine in engines), return_exceptions=True
+        )
+        errors: list[CommandFailure | None] = []
+        for result in results:
+            if result is not None and not isinstance(result, CommandFailure):
+                raise result
+            errors.append(result)
+        return list(zip(engines, errors, strict=True))
+
     @asynccontextmanager
     async def engine_timeout(
         self, engine_name: str, long: bool = False, close: bool = True, context: str | None = None
@@ -140,28 +265,17 @@ class Engine(Base):
                 await self.close_engine(self.loaded_engines[engine_name])
             raise CommandFailure(
                 f"Engine {engine_name} crashed"
-                + (" in {context}" if context is not None else "")
+                + (f" in {context}" if context is not None else "")
                 + f": {e}"
             ) from e
 
     def get_engines_log(self) -> Sequence[str]:
-        """Get log messages from all engines."""
-        # Read all log messages from the log_queue:
-        # Note that this is not wait free.
-        with suppress(queue.Empty):
-            while True:
-                self._engines_saved_log.append(self._engines_log_queue.get_nowait().message)
-        return self._engines_saved_log
+        """Get the last `ENGINE_LOG_SIZE` log messages from all engines."""
+        return list(self._engines_log.buffer)
 
     def clear_engines_log(self) -> None:
         """Clear the log."""
-        self._engines_saved_log.clear()
-        # Note that this is not wait free.
-        try:
-            while True:
-                self._engines_log_queue.get_nowait()
-        except queue.Empty:
-            pass
+        self._engines_log.buffer.clear()
 
     @override
     def load_config(self) -> None:
@@ -169,15 +283,14 @@ class Engine(Base):
         ## Retrieve the engine configurations from `self.config`:
         engine_confs = self.config["engine-configurations"]
         assert isinstance(engine_confs, dict), "Section 'engine-configurations' must be a dict"
-        self._engine_confs = {
-            name: EngineConf.validate(values) for (name, values) in engine_confs.items()
-        }
+        # Update the dict in place so that `_engine_confs_view` stays valid.
+        self._engine_confs.clear()
+        self._engine_confs.update(_ENGINE_CONFS_ADAPTER.validate_python(engine_confs))
 
     @override
     def save_config(self) -> None:
         self.config["engine-configurations"] = {
-            name: conf.model_dump(mode="json", exclude={"loaded_as"})
-            for (name, conf) in self.engine_confs.items()
+            name: conf.model_dump() for (name, conf) in self._engine_confs.items()
         }
         super().save_config()
 
@@ -205,98 +318,53 @@ class Engine(Base):
             shutil.rmtree(removed.install_dir)
         self.save_config()
 
-    def show_engine(self, name: str, verbose: bool = False) -> None:
-        """Show an engine, loaded or not."""
+    def show_engine(self, name: str, verbose: bool = False) -> str:
+        """Get a description of an engine, loaded or not."""
         # TODO: Fix separate methods for showing loaded and unloaded engines.
-        if name in self.loaded_engines:
-            conf: EngineConf = self.engine_confs[self.loaded_engines[name].config_name]
-        else:
-            conf = self.engine_confs[name]
-        show_str: str
-        show_str = (
-            ">"
-            if self.selected_engine is not None and name == self.selected_engine.loaded_name
-            else " "
+        loaded_engine: LoadedEngine | None = self._loaded_engines.get(name)
+        selected: bool = (
+            self._selected_engine is not None and name == self._selected_engine.loaded_name
         )
-        show_str += name
-        if conf.fullname is not None:
-            show_str += ": " + conf.fullname
-        if name in self.loaded_engines:
-            show_str += ", (loaded)"
-        else:
-            show_str += ", (not loaded)"
-        if self.selected_engine is not None and name == self.selected_engine.loaded_name:
-            show_str += ", (selected)"
-        self.poutput(show_str)
+        conf: EngineConf = self._engine_confs[
+            loaded_engine.config_name if loaded_engine is not None else name
+        ]
+        fullname: str = f": {conf.fullname}" if conf.fullname is not None else ""
+        loaded: str = "loaded" if loaded_engine is not None else "not loaded"
+        lines: list[str] = [
+            f"{">" if selected else " "}{name}{fullname}, ({loaded})"
+            + (", (selected)" if selected else "")
+        ]
         if verbose:
-            self.poutput(f"    Executable: {conf.path}")
-            self.poutput(f"    Protocol: {conf.protocol}")
-            if name in self.loaded_engines:
-                engine: chess.engine.Protocol = self.loaded_engines[name].engine
-                for key, val in engine.id.items():
-                    if key != "name":
-                        self.poutput(f"   {key}: {val}")
-
-    async def set_engine_option(
-        self, engine: LoadedEngine, name: str, value: str | int | bool | None
-    ) -> None:
-        """Set an option on a loaded engine."""
+            lines += (f"    Executable: {conf.path}", f"    Protocol: {conf.protocol}")
+            if loaded_engine is not None:
+                lines.extend(
+                    f"   {key}: {val}"
+                    for key, val in loaded_engine.engine.id.items()
+                    if key != "name"
+                )
+        return "\n".join(lines)
+
+    def validate_engine_option(self, engine: LoadedEngine, name: str, value: OptionValue) -> str:
+        """Check that an option on a loaded engine can be set to a value.
+
+        Raises ValueError if it can't.
+
+        :return: The name of the option as given by the engine.
+        """
         options: Mapping[str, chess.engine.Option] = engine.engine.options
         option: chess.engine.Option = options[name]
-        if option.type in ["string", "file", "path"]:
-            if not isinstance(value, str):
-                raise ValueError(
-                    f"{name} is a {option.type} according to the engine but the given type is"
-                    f" {type(value)} which doesn't match very well."
-                )
-        elif option.type == "combo":
-            if not isinstance(value, str):
-                raise ValueError(
-                    f"{name} is a {option.type} according to the engine but the given type is"
-                    f" {type(value)} which doesn't match very well."
-                )
+        try:
+            validate_option = _OPTION_VALIDATORS[option.type]
+        except KeyError:
+            raise AssertionError(f"Unsupported option type: {option.type}") from None
+        validate_option(name, option, value)
+        return option.name
 
-            if not option.var:
-                raise ValueError(
-                    f"There are no valid alternatives for {option.name}, so you cannot set it to"
-                    " any value. It's strange I know, but I'm probably not the engine's author so"
-                    " I can't do much about it."
-                )
-            if value not in option.var:
-                raise ValueError(
-                    f"{value} is not a valid alternative for the combobox {option.name}. The list"
-                    f" of valid options is: {option.var!r}."
-                )
-        elif option.type == "spin":
-            if not isinstance(value, int):
-                raise ValueError(
-                    f"{name} is a {option.type} according to the engine but the given type is"
-                    f" {type(value)} which doesn't match very well."
-                )
-            if option.min is not None and value < option.min:
-                raise ValueError(
-                    f"The minimum value for {option.name} is {option.min}, you specified {value}."
-                )
-            if option.max is not None and value > option.max:
-                raise ValueError(
-                    f"The maximum value for {option.name} is {option.max}, you specified {value}."
-                )
-        elif option.type == "check":
-            if not isinstance(value, bool):
-                raise ValueError(
-                    f"{name} is a {option.type} according to the engine but the given type is"
-                    f" {type(value)} which doesn't match very well."
-                )
-        elif option.type in ["button", "reset", "save"]:
-            if value is not None:
-                raise ValueError(
-                    f"{name} is a button according to the engine but the given value is a"
-                    f" {type(value)} which doesn't really make any sence."
-                )
-        else:
-            raise AssertionError(f"Unsupported option type: {option.type}")
+    async def set_engine_option(self, engine: LoadedEngine, name: str, value: OptionValue) -> None:
+        """Set an option on a loaded engine."""
+        opt_name: str = self.validate_engine_option(engine, name, value)
         async with self.engine_timeout(engine.loaded_name):
-            await engine.engine.configure({option.name: value})
+            await engine.engine.configure({opt_name: value})
 
     async def load_engine(self, config_name: str, name: str) -> None:
         """Load an engine.
@@ -320,24 +388,33 @@ class Engine(Base):
             ) from e
         except OSError as e:
             raise CommandFailure(f"While loading engine executable {engine_conf.path}: {e}") from e
-        engine: LoadedEngine = LoadedEngine(name, config_name, engine_)
+        engine: LoadedEngine = LoadedEngine(
+            name, config_name, engine_, {opt_name.lower(): opt_name for opt_name in engine_.options}
+        )
         self._loaded_engines[name] = engine
         engine_conf.fullname = engine_.id.get("name")
         engine_conf.loaded_as.add(name)
 
         ## Set all the configured options:
-        invalid_options: list[str] = []
+        # The options are validated first and then sent to the engine in one go.
+        valid_options: dict[str, OptionValue] = {}
+        invalid_options: set[str] = set()
         for opt_name, value in engine_conf.options.items():
             try:
-                await self.set_engine_option(engine, opt_name, value)
+                valid_options[self.validate_engine_option(engine, opt_name, value)] = value
             except ValueError as e:
                 self.poutput(
                     f"Warning: Couldn't set {opt_name} to {value} as specified in the"
                     " configuration."
                 )
                 self.poutput(f"    {e}")
-                invalid_options.append(opt_name)
+                invalid_options.add(opt_name)
                 self.poutput(f"  {opt_name} will be removed from the configuration.")
-        for x in invalid_options:
-            del engine_conf.options[x]
+        if invalid_options:
+            engine_conf.options = {
+                k: v for k, v in engine_conf.options.items() if k not in invalid_options
+            }
+        if valid_options:
+            async with self.engine_timeout(name):
+                await engine_.configure(valid_options)
         self.select_engine(name)
@@ -1,22 +1,118 @@
+import asyncio
 import os
-import platform
 import re
 import shutil
-import urllib.request
 from argparse import ArgumentParser
 from collections.abc import Iterable, Mapping
+from contextlib import suppress
+from http import HTTPStatus
 
 import appdirs
 import chess
 import chess.engine
 import chess.pgn
-import psutil
 
 from .base import CommandFailure
-from .engine import Engine, EngineConf, EngineProtocol, LoadedEngine
+from .engine import Engine, EngineConf, EngineProtocol, LoadedEngine, OptionValue
 from .repl import argparse_command
 from .utils import sizeof_fmt
 
+# Max size of a downloaded zip archive to keep in memory before spilling it to disk.
+ZIP_BUFFER_SIZE: int = 128 * 2**20
+
+# Engine option types which are buttons.
+BUTTON_OPTION_TYPES: frozenset[str] = frozenset({"button", "reset", "save"})
+# Engine option types which take the text given to `engine config set` as is, including combo
+# boxes whose value is one of their choices.
+TEXT_VALUE_OPTION_TYPES: frozenset[str] = frozenset({"string", "combo", "file", "path"})
+# Case insensitive values which a checkbox can be set to with `engine config set`.
+CHECKBOX_TRUE_VALUES: frozenset[str] = frozenset({"true", "check"})
+CHECKBOX_FALSE_VALUES: frozenset[str] = frozenset({"false", "uncheck"})
+
+# Names to show for the types of engine options. Plain buttons are shown separately.
+OPTION_TYPE_NAMES: dict[str, str] = {
+    "check": "checkbox",
+    "combo": "combobox",
+    "spin": "integer",
+    "string": "text",
+    "file": "text (file path)",
+    "path": "text (directory path)",
+    "reset": "button (reset)",
+    "save": "button (save)",
+}
+
+# The engine option types matched by each type filter of `engine config ls -t`.
+OPTION_TYPE_FILTERS: dict[str, frozenset[str]] = {
+    "checkbox": frozenset({"check"}),
+    "combobox": frozenset({"combo"}),
+    "integer": frozenset({"spin"}),
+    "text": frozenset({"string", "file", "path"}),
+    "button": BUTTON_OPTION_TYPES,
+}
+
+
+def _download_and_unpack(
+    url: str, archive_format: str, dir: str, etag_file: str, required_member: str
+) -> bool:
+    """Download an archive and unpack it to a directory.
+
+    The ETag of the download is saved in `etag_file` and if that file exists, the archive is only
+    downloaded if it has changed since.
+
+    :param archive_format: Either "tar" or "zip".
+    :param required_member: A path in the archive which must exist, or CommandFailure is raised.
+    :return: False if the download was skipped because the archive hasn't changed.
+    """
+    import tarfile
+    import tempfile
+    import urllib.error
+    import urllib.request
+    import zipfile
+
+    headers: dict[str, str] = {}
+    with suppress(FileNotFoundError), open(etag_file) as f:
+        headers["If-None-Match"] = f.read().strip()
+    try:
+        response = urllib.request.urlopen(urllib.request.Request(url, headers=headers))
+    except urllib.error.HTTPError as e:
+        if e.code == HTTPStatus.NOT_MODIFIED:
+            return False
+        raise
+    # Unpack to a temporary directory first, so that the current installation is left intact if
+    # the download fails or the archive is incomplete.
+    with response, tempfile.TemporaryDirectory(dir=dir) as unpack_dir:
+        match archive_format:
+            case "tar":
+                # Extract the members while they are downloaded.
+                with tarfile.open(fileobj=response, mode="r|") as tar_archive:
+                    tar_archive.extractall(unpack_dir, filter="data")
+            case "zip":
+                # Zip files must be seekable, so the download is buffered first. It is only
+                # written to disk if it is bigger than max_size.
+                with tempfile.SpooledTemporaryFile(max_size=ZIP_BUFFER_SIZE) as buffer:
+                    shutil.copyfileobj(response, buffer)
+                    with zipfile.ZipFile(buffer) as zip_archive:
+                        zip_archive.extractall(unpack_dir)
+            case x:
+                raise AssertionError(f"Unsupported archive format: {x}")
+        if not os.path.isfile(os.path.join(unpack_dir, required_member)):
+            raise CommandFailure(
+                f"Error: The downloaded archive doesn't contain {required_member}."
+            )
+        for name in os.listdir(unpack_dir):
+            target: str = os.path.join(dir, name)
+            if os.path.isdir(target) and not os.path.islink(target):
+                shutil.rmtree(target)
+            os.replace(os.path.join(unpack_dir, name), target)
+        etag: str | None = response.headers.get("ETag")
+    if etag is not None:
+        with open(etag_file, "w") as f:
+            f.write(etag)
+    else:
+        with suppress(FileNotFoundError):
+            os.remove(etag_file)
+    return True
+
 
 class EngineCmds(Engine):
     """Basic commands related to chess engines."""
@@ -70,7 +166,10 @@ class EngineCmds(Engine):
         "engine", choices=["stockfish", "lc0"], help="Which engine to install."
     )
     engine_quit_argparser = engine_subcmds.add_parser(
-        "quit", aliases=["q"], help="Quit all selected engines."
+        "quit", aliases=["q"], help="Quit the selected engine."
+    )
+    engine_quit_argparser.add_argument(
+        "-a", "--all", action="store_true", help="Quit all loaded engines."
     )
     engine_select_argparser = engine_subcmds.add_parser(
         "select",
@@ -102,7 +201,7 @@ class EngineCmds(Engine):
     engine_config_ls_argparser.add_argument(
         "-t",
         "--type",
-        choices=["checkbox", "combobox", "integer", "text", "button"],
+        choices=OPTION_TYPE_FILTERS.keys(),
         nargs="+",
         help="Filter options by the given type.",
     )
@@ -221,8 +320,10 @@ class EngineCmds(Engine):
             engines: Iterable[str] = self.loaded_engines.keys()
         else:
             engines = self.engine_confs.keys()
-        for engine in engines:
-            self.show_engine(engine, verbose=args.verbose)
+        if engines:
+            self.poutput(
+                "\n".join(self.show_engine(engine, verbose=args.verbose) for engine in engines)
+            )
 
     async def engine_load(self, name: str, load_as: str) -> None:
         try:
@@ -241,7 +342,7 @@ class EngineCmds(Engine):
                 return
             await self.load_engine(name, load_as)
             self.select_engine(load_as)
-            self.show_engine(load_as, verbose=True)
+            self.poutput(self.show_engine(load_as, verbose=True))
             self.poutput(f"Successfully loaded and selected {name} as {load_as}.")
         except OSError:
             self.poutput(
@@ -298,6 +399,10 @@ class EngineCmds(Engine):
                 raise AssertionError("Invalid argument")
 
     async def install_stockfish(self) -> None:
+        import platform
+
+        import psutil
+
         dir: str = os.path.join(appdirs.user_data_dir("chess-cli"), "stockfish")
         os.makedirs(dir, exist_ok=True)
         url: str
@@ -314,26 +419,33 @@ class EngineCmds(Engine):
                 executable = "stockfish/stockfish-windows-x86-64-avx2.exe"
             case x:
                 raise CommandFailure(f"Error: Unsupported platform: {x}")
-        self.poutput("Downloading Stockfish...")
-        engine_archive, _ = urllib.request.urlretrieve(url)
-        self.poutput("Download complete. Unpacking...")
-        shutil.unpack_archive(engine_archive, dir, archive_format)
-        urllib.request.urlcleanup()
+        executable_path: str = os.path.join(dir, executable)
+        etag_file: str = os.path.join(dir, "etag")
+        if not os.path.exists(executable_path):
+            # Don't skip the download if the old executable is gone.
+            with suppress(FileNotFoundError):
+                os.remove(etag_file)
+        self.poutput("Downloading and unpacking Stockfish...")
+        # Download in a separate thread so that the event loop isn't blocked.
+        downloaded: bool = await asyncio.to_thread(
+            _download_and_unpack, url, archive_format, dir, etag_file, executable
+        )
+        self.poutput("Done." if downloaded else "The latest Stockfish is already downloaded.")
         if "stockfish" in self.engine_confs:
             self.poutput("Removing old stockfish")
             await self.exec_cmd("engine rm stockfish")
-        executable_path: str = os.path.join(dir, executable)
         await self.exec_cmd(f'engine import "{executable_path}" stockfish')
-        ncores: int = psutil.cpu_count()
-        ncores_use: int = ncores - 1 if ncores > 1 else 1
+        # cpu_count() returns None if the number of cores can't be determined.
+        ncores: int = psutil.cpu_count(logical=True) or 1
+        ncores_use: int = max(1, ncores - 1)
         self.poutput(
             f"You seem to have {ncores} logical cores on your system. So the engine will use"
             f" {ncores_use} of them."
         )
         await self.exec_cmd(f"engine config set threads {ncores_use}")
         ram: int = psutil.virtual_memory().total
-        ram_use_MiB: int = int(0.75 * ram / 2**20)
-        ram_use: int = ram_use_MiB * 2**20
+        ram_use_MiB: int = (ram * 3) >> 22  # 75 % of the RAM in MiB.
+        ram_use: int = ram_use_MiB << 20
         self.poutput(
             f"You seem to have a RAM of {sizeof_fmt(ram)} bytes, so stockfish will be configured to"
             f" use {sizeof_fmt(ram_use)} bytes (75 %) thereof for the hash."
@@ -341,68 +453,56 @@ class EngineCmds(Engine):
         await self.exec_cmd(f"engine config set hash {ram_use_MiB}")
         self.poutput("You can change these settings and more with the engine config command.")
 
-    async def engine_quit(self, _args) -> None:
-        if self.selected_engine is None:
-            self.poutput("Error: No engine to quit.")
+    async def engine_quit(self, args) -> None:
+        engines: list[LoadedEngine]
+        if args.all:
+            engines = list(self.loaded_engines.values())
         else:
-            await self.close_engine(self.selected_engine)
-            self.poutput(f"Quitted {self.selected_engine} without any problems.")
+            engines = [self.selected_engine] if self.selected_engine is not None else []
+        if not engines:
+            self.poutput("Error: No engine to quit.")
+            return
+        for engine, error in await self.close_engines(engines):
+            if error is None:
+                self.poutput(f"Quitted {engine.loaded_name} without any problems.")
+            else:
+                self.perror(f"Error: {error}")
 
-    def show_engine_option(self, engine: LoadedEngine, name: str) -> None:
+    def show_engine_option(self, engine: LoadedEngine, name: str) -> str:
+        """Get a line describing an option of a loaded engine and its value."""
         opt: chess.engine.Option = engine.engine.options[name]
-        configured_val: str | int | bool | None = self.engine_confs[engine.config_name].options.get(
-            name
-        )
-        val: str | int | bool | None = configured_val or opt.default
+        configured_val: OptionValue = self.engine_confs[engine.config_name].options.get(name)
+        val: OptionValue = configured_val if configured_val is not None else opt.default
 
-        show_str: str = name
+        parts: list[str] = [name]
         if val is not None:
-            if opt.type == "checkbox":
-                if val:
-                    show_str += " [X]"
-                else:
-                    show_str += " [ ]"
+            if opt.type == "check":
+                parts.append(" [X]" if val else " [ ]")
             else:
-                show_str += " = " + repr(val)
+                parts.append(f" = {val!r}")
         if opt.type == "button":
-            show_str += ": (button)"
+            parts.append(": (button)")
         else:
             if configured_val is not None and opt.default is not None:
-                show_str += f": Default: {opt.default!r}, "
+                parts.append(f": Default: {opt.default!r}, ")
             else:
-                show_str += " (default): "
+                parts.append(" (default): ")
             if opt.var:
-                show_str += f"Alternatives: {opt.var!r}, "
+                parts.append(f"Alternatives: {opt.var!r}, ")
             if opt.min is not None:
-                show_str += f"Min: {opt.min!r}, "
+                parts.append(f"Min: {opt.min!r}, ")
             if opt.max is not None:
-                show_str += f"Max: {opt.max!r}, "
-            show_str += "Type: "
-            if opt.type == "check":
-                show_str += "checkbox"
-            elif opt.type == "combo":
-                show_str += "combobox"
-            elif opt.type == "spin":
-                show_str += "integer"
-            elif opt.type == "string":
-                show_str += "text"
-            elif opt.type == "file":
-                show_str += "text (file path)"
-            elif opt.type == "path":
-                show_str += "text (directory path)"
-            elif opt.type == "reset":
-                show_str += "button (reset)"
-            elif opt.type == "save":
-                show_str += "button (save)"
-            else:
-                raise AssertionError(f"Unsupported option type: {opt.type}.")
+                parts.append(f"Max: {opt.max!r}, ")
+            try:
+                parts.append(f"Type: {OPTION_TYPE_NAMES[opt.type]}")
+            except KeyError:
+                raise AssertionError(f"Unsupported option type: {opt.type}.") from None
 
         if configured_val is not None:
-            show_str += ", (Configured)"
+            parts.append(", (Configured)")
         if opt.is_managed():
-            show_str += ", (Managed automatically)"
-
-        self.poutput(show_str)
+            parts.append(", (Managed automatically)")
+        return "".join(parts)
 
     async def engine_config(self, args) -> None:
         if not self.selected_engine:
@@ -429,10 +529,9 @@ class EngineCmds(Engine):
 
         Raises CommandFailure if not found.
         """
-        options: Mapping[str, chess.engine.Option] = engine.engine.options
         try:
-            return next(n for n in options if n.lower() == name.lower())
-        except StopIteration:
+            return engine.option_names[name.lower()]
+        except KeyError:
             self.poutput(
                 f"Error: No option named {name} in the engine {engine.loaded_name}. "
                 "List all availlable options with `engine config ls`."
@@ -442,7 +541,7 @@ class EngineCmds(Engine):
     def engine_config_get(self, args) -> None:
         engine: LoadedEngine = self.get_selected_engine()
         opt_name: str = self.get_engine_opt_name(engine, args.name)
-        self.show_engine_option(engine, opt_name)
+        self.poutput(self.show_engine_option(engine, opt_name))
 
     async def engine_config_reset(self, args) -> None:
         engine: LoadedEngine = self.get_selected_engine()
@@ -454,35 +553,37 @@ class EngineCmds(Engine):
 
     def engine_config_ls(self, args) -> None:
         engine: LoadedEngine = self.get_selected_engine()
-        conf: EngineConf = self.engine_confs[engine.config_name]
+        configured_options: dict[str, OptionValue] = self.engine_confs[engine.config_name].options
+        pattern: re.Pattern[str] | None = None
+        if args.regex:
+            try:
+                pattern = re.compile(args.regex, flags=re.IGNORECASE)
+            except re.error as e:
+                self.poutput(f'Error: Invalid regular expression "{args.regex}": {e}')
+                return
+        types: frozenset[str] | None = (
+            frozenset().union(*(OPTION_TYPE_FILTERS[t] for t in args.type)) if args.type else None
+        )
+        lines: list[str] = []
         for name, opt in engine.engine.options.items():
-            if (args.configured and name not in conf.options) or (
-                args.not_configured and name in conf.options
-            ):
+            configured: bool = name in configured_options
+            if (args.configured and not configured) or (args.not_configured and configured):
+                continue
+            if opt.is_managed() and not args.include_auto and not configured:
                 continue
-            if opt.is_managed() and not args.include_auto and name not in conf.options:
+            if types is not None and opt.type not in types:
                 continue
-            if args.regex:
-                try:
-                    pattern: re.Pattern = re.compile(args.regex, flags=re.IGNORECASE)
-                except re.error as e:
-                    self.poutput(f'Error: Invalid regular expression "{args.regex}": {e}')
-                    return
-                if not pattern.fullmatch(name):
-                    continue
-            if args.type and (
-                (opt.type == "check" and "checkbox" not in args.type)
-                or opt.type == "combo"
-                and "combobox" not in args.type
-                or opt.type == "spin"
-                and "integer" not in args.type
-                or opt.type in ["button", "reset", "save"]
-                and "button" not in args.type
-                or opt.type in ["string", "file", "path"]
-                and "string" not in args.type
-            ):
+            if pattern is not None and not pattern.fullmatch(name):
                 continue
-            self.show_engine_option(engine, name)
+            lines.append(self.show_engine_option(engine, name))
+        if lines:
+            self.poutput("\n".join(lines))
+
+    def store_engine_option(self, conf: EngineConf, name: str, value: OptionValue) -> None:
+        """Store an option in an engine's configuration and save the configuration if it changed."""
+        if name not in conf.options or conf.options[name] != value:
+            conf.options[name] = value
+            self.save_config()
 
     async def engine_config_set(self, args) -> None:
         engine: LoadedEngine = self.get_selected_engine()
@@ -490,8 +591,8 @@ class EngineCmds(Engine):
         conf: EngineConf = self.engine_confs[engine.config_name]
         opt_name: str = self.get_engine_opt_name(engine, args.name)
         option: chess.engine.Option = options[opt_name]
-        if option.type in ["string", "combo", "file", "path"]:
-            value: str | int | bool | None = args.value
+        if option.type in TEXT_VALUE_OPTION_TYPES:
+            value: OptionValue = args.value
         elif option.type == "spin":
             try:
                 value = int(args.value)
@@ -502,9 +603,9 @@ class EngineCmds(Engine):
                 )
                 return
         elif option.type == "check":
-            if args.value.lower() in ["true", "check"]:
+            if args.value.lower() in CHECKBOX_TRUE_VALUES:
                 value = True
-            elif args.value in ["false", "uncheck"]:
+            elif args.value.lower() in CHECKBOX_FALSE_VALUES:
                 value = False
             else:
                 self.poutput(
@@ -513,7 +614,7 @@ class EngineCmds(Engine):
                     " your mistake."
                 )
                 return
-        elif option.type in ["button", "reset", "save"]:
+        elif option.type in BUTTON_OPTION_TYPES:
             if args.value.lower() != "trigger-on-startup":
                 self.poutput(
                     f"{option.name} is a button and buttons can only be configured to"
@@ -530,8 +631,7 @@ class EngineCmds(Engine):
         else:
             raise AssertionError(f"Unsupported option type: {option.type}")
         if not args.temporary:
-            conf.options[option.name] = value
-            self.save_config()
+            self.store_engine_option(conf, option.name, value)
         await self.set_engine_option(engine, option.name, value)
 
     async def engine_config_unset(self, args) -> None:
@@ -555,14 +655,15 @@ class EngineCmds(Engine):
 
         if not args.temporary:
             conf: EngineConf = self.engine_confs[engine.config_name]
-            conf.options.pop(opt_name, None)
-            self.save_config()
+            if opt_name in conf.options:
+                del conf.options[opt_name]
+                self.save_config()
 
     async def engine_config_trigger(self, args) -> None:
         engine: LoadedEngine = self.get_selected_engine()
         options: Mapping[str, chess.engine.Option] = engine.engine.options
         opt_name: str = self.get_engine_opt_name(engine, args.name)
-        if options[opt_name].type not in ["button", "reset", "save"]:
+        if options[opt_name].type not in BUTTON_OPTION_TYPES:
             self.poutput(f"Error: {opt_name} is not a button.")
             return
         await engine.engine.configure({opt_name: None})
@@ -12,7 +12,6 @@ from typing import assert_never
 import chess
 import chess.pgn
 import progressbar
-import pyperclip
 
 from .base import CommandFailure, GameHandle
 from .game_utils import GameUtils
@@ -476,6 +475,8 @@ class GameCmds(GameUtils):
         if args.fen or file_path and file_path.suffix == ".fen":
             fen: str = self.game_node.board().fen()
             if args.clipboard:
+                import pyperclip
+
                 pyperclip.copy(fen)
                 print("FEN copied to clipboard.")
             if file_path is not None:
@@ -485,6 +486,8 @@ class GameCmds(GameUtils):
         else:
             games: Iterable[int] = [self.game_idx] if args.this else range(len(self.games))
             if args.clipboard:
+                import pyperclip
+
                 pgn_io = io.StringIO()
                 self.write_games(pgn_io, games)
                 pyperclip.copy(pgn_io.getvalue())
@@ -518,6 +521,8 @@ class GameCmds(GameUtils):
                 raise CommandFailure("You cannot both specify `--dialog` and a file name.")
             self.load_games_from_file(args.file)
         elif args.clipboard:
+            import pyperclip
+
             clip: str = pyperclip.paste()
             if not clip:
                 raise CommandFailure("The clipboard is empty.")
@@ -1,7 +1,7 @@
 import math
 import re
 from contextlib import suppress
-from datetime import datetime, timedelta
+from datetime import timedelta
 from typing import NamedTuple, assert_never, override
 
 import chess.engine
@@ -20,32 +20,41 @@ def sizeof_fmt(num, suffix="B"):
     return f"{num:.1f}Yi{suffix}"
 
 
-COMMANDS_IN_COMMENTS_REGEX: re.Pattern[str] = re.compile(r"\[%.+?\]")
+COMMANDS_IN_COMMENTS_REGEX: re.Pattern[str] = re.compile(r"(\[%.+?\])")
 
 
-def commands_in_comment(raw_comment: str) -> str:
-    """Get a string with all embedded commands in a pgn comment."""
-    return " ".join(COMMANDS_IN_COMMENTS_REGEX.findall(raw_comment))
+def split_comment(raw_comment: str) -> tuple[str, str]:
+    """Split a pgn comment into its text and its embedded commands in a single scan.
+
+    :return: A tuple `(text, commands)` where `text` is what `comment_text()` returns and
+    `commands` is all embedded commands separated by spaces.
+    """
+    parts: list[str] = COMMANDS_IN_COMMENTS_REGEX.split(raw_comment)
+    return " ".join(parts[::2]).strip(), " ".join(parts[1::2])
 
 
 def comment_text(raw_comment: str) -> str:
     """Strip out all commands like [%cal xxx] or [%clk xxx] from a comment."""
-    return " ".join(COMMANDS_IN_COMMENTS_REGEX.split(raw_comment)).strip()
+    return split_comment(raw_comment)[0]
+
 
+def join_comment(commands: str, text: str) -> str:
+    """Build a comment from embedded commands and text, as returned by `split_comment()`."""
+    if commands:
+        return commands + "\n" + text
+    return text
 
-def update_comment_text(original_comment: str, new_text: str) -> str:
-    """Return a new comment with the same embedded commands but with the text
-    replaced."""
-    if cmds := commands_in_comment(original_comment):
-        return cmds + "\n" + new_text
-    return new_text
+
+def append_comment_text(commands: str, text: str, add_text: str) -> str:
+    """Build a comment from embedded commands and text, as returned by `split_comment()`, with some
+    text added after the existing text."""
+    return join_comment(commands, text + "\n" + add_text if text else add_text)
 
 
 def add_to_comment_text(original_comment: str, add_text: str) -> str:
     """Add some text to a comment without touching existing text or commands."""
-    if text := comment_text(original_comment):
-        return update_comment_text(original_comment, text + "\n" + add_text)
-    return update_comment_text(original_comment, add_text)
+    text, commands = split_comment(original_comment)
+    return append_comment_text(commands, text, add_text)
 
 
 MOVE_NUMBER_REGEX: re.Pattern[str] = re.compile(r"(\d+)((\.{3})|\.?)")
@@ -254,17 +263,20 @@ def show_rounded_time(
     return show_time(time=time, decimals=decimals, short=short, trailing_zeros=trailing_zeros)
 
 
+# Matches a time like "[[hours:]minutes:]seconds" with the same ranges as `datetime.strptime()`
+# accepts for "%H:%M:%S", "%M:%S" and "%S".
+TIME_REGEX: re.Pattern[str] = re.compile(r"(?:(?:(2[0-3]|[01]?\d):)?([0-5]?\d):)?([0-5]?\d)")
+
+
 def parse_time(time_str: str) -> timedelta:
-    formats = ["%H:%M:%S", "%M:%S", "%S"]
-    for fmt in formats:
-        try:
-            dt: datetime = datetime.strptime(time_str, fmt)
-            return dt - datetime.strptime("0", "%S")
-        except ValueError:
-            pass
+    if (time_match := TIME_REGEX.fullmatch(time_str)) is not None:
+        hours, minutes, seconds = time_match.groups()
+        return timedelta(hours=int(hours or 0), minutes=int(minutes or 0), seconds=int(seconds))
     with suppress(ValueError):
         return timedelta(seconds=float(time_str))
-    raise ValueError(f"Failed to parse {time_str} by any of the formats: {formats}")
+    raise ValueError(
+        f"Failed to parse {time_str} as [[hours:]minutes:]seconds or a number of seconds."
+    )
 
 
 def parse_time_control(text: str) -> tuple[timedelta, timedelta]:
@@ -351,6 +363,50 @@ def castling_descr(board: chess.Board) -> str:
         return f"White {white_descr} and Black {black_descr}."
 
 
+def fast_fen(board: chess.Board) -> str:
+    """Get the FEN of a board.
+
+    Gives the same result as `board.fen()`, but the piece placement is built in one pass over the
+    piece bitboards instead of looking up every square.
+    """
+    symbols: list[str] = [""] * 64
+    for color in chess.COLORS:
+        for piece_type in chess.PIECE_TYPES:
+            symbol: str = chess.piece_symbol(piece_type)
+            if color == chess.WHITE:
+                symbol = symbol.upper()
+            for square in chess.scan_forward(board.pieces_mask(piece_type, color)):
+                symbols[square] = symbol
+
+    parts: list[str] = []
+    for rank in range(7, -1, -1):
+        # Walk the occupied squares of the rank by repeatedly taking the lowest set bit, so that
+        # runs of empty squares are computed as differences between files.
+        occupied: chess.Bitboard = (board.occupied >> (8 * rank)) & 0xFF
+        prev_file: int = -1
+        while occupied:
+            file: int = (occupied & -occupied).bit_length() - 1
+            if file - prev_file > 1:
+                parts.append(str(file - prev_file - 1))
+            parts.append(symbols[8 * rank + file])
+            prev_file = file
+            occupied &= occupied - 1
+        if prev_file < 7:
+            parts.append(str(7 - prev_file))
+        if rank:
+            parts.append("/")
+
+    ep_square = board.ep_square if board.has_legal_en_passant() else None
+    return " ".join([
+        "".join(parts),
+        "w" if board.turn == chess.WHITE else "b",
+        board.castling_xfen(),
+        chess.SQUARE_NAMES[ep_square] if ep_square is not None else "-",
+        str(board.halfmove_clock),
+        str(board.fullmove_number),
+    ])
+
+
 class BoardSearcher(chess.pgn.BaseVisitor[None]):
     """Search for a particular position in a game.
 
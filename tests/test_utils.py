@@ -0,0 +1,57 @@
+import random
+
+import chess
+import pytest
+
+from chess_cli.utils import fast_fen
+
+
+def random_boards(rng: random.Random, start: chess.Board, games: int = 20) -> list[chess.Board]:
+    """Play random games from a starting position and return every position on the way."""
+    boards: list[chess.Board] = []
+    for _ in range(games):
+        board: chess.Board = start.copy()
+        boards.append(board.copy(stack=False))
+        while board.ply() < 200:
+            moves: list[chess.Move] = list(board.legal_moves)
+            if not moves:
+                break
+            # Prefer double pawn pushes to get many positions with an en-passant square.
+            double_pushes: list[chess.Move] = [
+                m for m in moves if board.is_zeroing(m) and abs(m.to_square - m.from_square) == 16
+            ]
+            board.push(rng.choice(double_pushes if double_pushes and rng.random() < 0.3 else moves))
+            boards.append(board.copy(stack=False))
+    return boards
+
+
+def test_fast_fen_standard() -> None:
+    rng = random.Random(0)
+    boards: list[chess.Board] = random_boards(rng, chess.Board())
+    assert any(b.has_legal_en_passant() for b in boards)
+    for board in boards:
+        assert fast_fen(board) == board.fen()
+
+
+def test_fast_fen_chess960() -> None:
+    rng = random.Random(1)
+    for _ in range(10):
+        start = chess.Board.from_chess960_pos(rng.randrange(960))
+        for board in random_boards(rng, start, games=3):
+            assert fast_fen(board) == board.fen()
+
+
+@pytest.mark.parametrize(
+    "fen",
+    [
+        chess.STARTING_FEN,
+        "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+        "rnbqkbnr/pppp1ppp/8/8/3Pp3/8/PPP1PPPP/RNBQKBNR b KQkq d3 0 2",
+        "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1",
+        "8/8/8/8/8/8/8/K6k w - - 0 1",
+        "bnrbkrqn/pppppppp/8/8/8/8/PPPPPPPP/BNRBKRQN w FCfc - 0 1",
+    ],
+)
+def test_fast_fen_positions(fen: str) -> None:
+    board = chess.Board(fen, chess960="FCfc" in fen)
+    assert fast_fen(board) == board.fen()